@@ -13,9 +13,8 @@ from Xlib import X, Xatom, display
 
 from optiwrapper import hooks
 from optiwrapper.configurator.ui.settingswindow import Ui_SettingsWindow
-from optiwrapper.lib import SETTINGS_DIR
 from optiwrapper.libxdo import xdo_select_window_with_click
-from optiwrapper.settings import Config
+from optiwrapper.settings import Config, watch_settings_dir
 
 logger = logging.getLogger("optiwrapper.configurator")
 logger.setLevel(logging.DEBUG)
@@ -179,11 +178,12 @@ class MainWindow(QMainWindow):  # type: ignore[misc]
         self.ui.action_reload.triggered.connect(self.reload_from_disk)
         self.ui.action_exit.triggered.connect(self.close)
 
-        # add existing games
-        for path in SETTINGS_DIR.glob("*.yaml"):
-            if path.stem == "sample":
+        # add existing games, and keep them cached until they change on disk
+        watch_settings_dir()
+        for game, config in Config.load_all().items():
+            if game == "sample":
                 continue
-            self.model.add_existing_game(path.stem)
+            self.model.add_config(config)
 
     def get_current_index(self) -> QModelIndex:
         return self.model.get_index(self.current_game)
@@ -285,7 +285,8 @@ class MainWindow(QMainWindow):  # type: ignore[misc]
             return
         text = self.ui.command_textbox.text()
         new_command = shlex.split(text)
-        if new_command != config.command:
+        # config.command may be a list or the default empty tuple
+        if tuple(new_command) != tuple(config.command):
             logger.debug("command changed to %r", text)
             config.command = new_command
             self.mark_updated()
@@ -326,7 +327,7 @@ class MainWindow(QMainWindow):  # type: ignore[misc]
             return
         name = item.text().partition(" ")[0]
         check_state = item.checkState()
-        flags_dict = config.flags.asdict()
+        flags_dict = config.mutable_flags().asdict()
         if name in flags_dict:
             prev_state = Checked if flags_dict[name] else Unchecked
         else:
@@ -361,9 +362,9 @@ class MainWindow(QMainWindow):  # type: ignore[misc]
             "enabled" if check_state == Checked else "disabled",
         )
         if check_state == Checked:
-            config.hooks.append(name)
+            config.mutable_hooks().append(name)
         elif check_state == Unchecked:
-            config.hooks.remove(name)
+            config.mutable_hooks().remove(name)
         else:
             assert False, f"invalid checkState: {check_state}"
         self.mark_updated()
@@ -0,0 +1,158 @@
+"""
+Tracks whether the game window is focused.
+"""
+
+import asyncio
+import re
+from datetime import datetime
+from typing import Callable, List, Optional, Set
+
+from optiwrapper import lib
+from optiwrapper.lib import logger
+
+FOCUS_SETTLE_TIME = 0.2
+
+
+class FocusTracker:  # pylint: disable=too-many-instance-attributes
+    """Reports when the game window gains or loses focus.
+
+    Windows are matched case-insensitively, like xdo did: `window_class` has to
+    match the whole class name, and `window_title` any part of the title.
+
+    Args:
+        window_title: A regex for the game window's title, or "".
+        window_class: A regex for the game window's class, or "".
+        callback: A function to execute when the game window is focused or
+            unfocused, with the new state and the time of the change. It isn't
+            called until the game window has been found.
+        missing_callback: A function to execute if the game window doesn't
+            show up within the timeout given to start().
+    """
+
+    # set once start() is called
+    loop: asyncio.AbstractEventLoop
+    # windows from _NET_CLIENT_LIST that were already checked for the game
+    known_clients: Set[int]
+    # None until the game window has been found
+    game_focused: Optional[bool]
+
+    def __init__(
+        self,
+        window_title: str,
+        window_class: str,
+        callback: Callable[[bool, datetime], None],
+        missing_callback: Callable[[], None],
+    ):
+        self._title_re = (
+            re.compile(window_title, re.IGNORECASE) if window_title else None
+        )
+        self._class_re = (
+            re.compile(window_class, re.IGNORECASE) if window_class else None
+        )
+        self.callback = callback
+        self.missing_callback = missing_callback
+        self.window_watcher: Optional[lib.ActiveWindowWatcher] = None
+        self.window_timeout: Optional[asyncio.TimerHandle] = None
+        self.pending_focus: Optional[asyncio.TimerHandle] = None
+        self.known_clients = set()
+        self.game_focused = None
+
+    def start(self, loop: asyncio.AbstractEventLoop, timeout: float) -> None:
+        """Connects to the X server and starts watching from `loop`.
+
+        Raises:
+            Xlib.error.DisplayError: If the X server can't be reached.
+        """
+        self.loop = loop
+        self.window_watcher = lib.ActiveWindowWatcher(
+            self.active_window_changed, self.client_list_changed
+        )
+        self.window_watcher.start(loop)
+        logger.debug("waiting for window...")
+        self.window_timeout = loop.call_later(timeout, self.window_wait_expired)
+        # the game window might already be open
+        self.client_list_changed(self.window_watcher.client_windows())
+        self.active_window_changed(self.window_watcher.active_window())
+
+    def close(self) -> None:
+        if self.window_timeout is not None:
+            self.window_timeout.cancel()
+            self.window_timeout = None
+        if self.pending_focus is not None:
+            self.pending_focus.cancel()
+            self.pending_focus = None
+        if self.window_watcher is not None:
+            self.window_watcher.close()
+            self.window_watcher = None
+
+    def is_game_window(self, window_id: int) -> bool:
+        if not window_id or self.window_watcher is None:
+            return False
+        # all the given conditions have to match, and each one needs a round
+        # trip to the X server, so only fetch what's needed
+        watcher = self.window_watcher
+        if (
+            self._class_re is not None
+            and self._class_re.fullmatch(watcher.window_class(window_id)) is None
+        ):
+            return False
+        if (
+            self._title_re is not None
+            and self._title_re.search(watcher.window_title(window_id)) is None
+        ):
+            return False
+        return True
+
+    def active_window_changed(self, window_id: int) -> None:
+        focused = self.is_game_window(window_id)
+        if self.game_focused is None:
+            # only act once the game window has shown up
+            if focused:
+                self.game_window_found(window_id, True)
+            return
+        # wait for the focus to settle (e.g. while alt-tabbing), and only
+        # report the final state
+        if self.pending_focus is not None:
+            self.pending_focus.cancel()
+        self.pending_focus = self.loop.call_later(
+            FOCUS_SETTLE_TIME, self.commit_focus, focused, datetime.now().astimezone()
+        )
+
+    def client_list_changed(self, window_ids: List[int]) -> None:
+        if self.game_focused is not None or self.window_watcher is None:
+            # the game window was already found
+            return
+        # the window may show up without being focused, so check the new ones
+        # (each check needs round trips to the X server)
+        known_clients = self.known_clients
+        self.known_clients = set(window_ids)
+        for window_id in window_ids:
+            if window_id not in known_clients and self.is_game_window(window_id):
+                active = self.window_watcher.active_window()
+                self.game_window_found(window_id, window_id == active)
+                return
+
+    def game_window_found(self, window_id: int, focused: bool) -> None:
+        logger.debug("found window: 0x%x", window_id)
+        if self.window_timeout is not None:
+            self.window_timeout.cancel()
+            self.window_timeout = None
+        self.commit_focus(focused, datetime.now().astimezone())
+
+    def commit_focus(self, focused: bool, dt: datetime) -> None:
+        self.pending_focus = None
+        if focused == self.game_focused:
+            return
+        self.game_focused = focused
+        self.callback(focused, dt)
+
+    def window_wait_expired(self) -> None:
+        self.window_timeout = None
+        if self.window_watcher is not None and any(
+            map(self.is_game_window, self.window_watcher.client_windows())
+        ):
+            # the game window exists, but was never focused
+            logger.debug("found unfocused window")
+            self.commit_focus(False, datetime.now().astimezone())
+            return
+        self.missing_callback()
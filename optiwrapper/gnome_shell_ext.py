@@ -3,6 +3,8 @@ Python implementation of gnome-extensions-tool.
 <https://gitlab.gnome.org/fmuellner/gnome-extensions-tool>
 """
 
+from typing import Optional
+
 from dbus_next import DBusError, Variant
 from dbus_next.aio import MessageBus, ProxyInterface
 
@@ -11,11 +13,28 @@ PATH = "/org/gnome/Shell"
 INTERFACE = "org.gnome.Shell.Extensions"
 
 
+_SHELL: Optional[ProxyInterface] = None
+
+
 async def get_shell() -> ProxyInterface:
-    bus = await MessageBus().connect()
-    introspection = await bus.introspect(NAME, PATH)
-    obj = bus.get_proxy_object(NAME, PATH, introspection)
-    return obj.get_interface(INTERFACE)
+    """
+    Returns the GNOME Shell extensions interface.
+
+    The bus connection and introspection data are reused for later calls.
+    """
+    global _SHELL  # pylint: disable=global-statement
+    if _SHELL is None:
+        bus = await MessageBus().connect()
+        introspection = await bus.introspect(NAME, PATH)
+        obj = bus.get_proxy_object(NAME, PATH, introspection)
+        _SHELL = obj.get_interface(INTERFACE)
+    return _SHELL
+
+
+def _reset_shell() -> None:
+    """Connect again next time, in case the connection itself is broken."""
+    global _SHELL  # pylint: disable=global-statement
+    _SHELL = None
 
 
 async def enable_extension(uuid: str) -> None:
@@ -24,9 +43,9 @@ async def enable_extension(uuid: str) -> None:
     """
     try:
         shell = await get_shell()
-        shell.call_enable_extension(uuid)  # type: ignore[attr-defined]
+        await shell.call_enable_extension(uuid)  # type: ignore[attr-defined]
     except DBusError:
-        pass
+        _reset_shell()
 
 
 async def disable_extension(uuid: str) -> None:
@@ -35,9 +54,9 @@ async def disable_extension(uuid: str) -> None:
     """
     try:
         shell = await get_shell()
-        shell.call_disable_extension(uuid)  # type: ignore[attr-defined]
+        await shell.call_disable_extension(uuid)  # type: ignore[attr-defined]
     except DBusError:
-        pass
+        _reset_shell()
 
 
 async def is_extension_enabled(uuid: str) -> bool:
@@ -47,10 +66,11 @@ async def is_extension_enabled(uuid: str) -> bool:
     try:
         shell = await get_shell()
         return bool(
-            (await shell.call_enable_extension(uuid))  # type: ignore[attr-defined]
+            (await shell.call_get_extension_info(uuid))  # type: ignore[attr-defined]
             .get("state", Variant("d", -1))
             .value
             == 1
         )
     except DBusError:
+        _reset_shell()
         return False
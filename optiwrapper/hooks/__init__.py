@@ -90,6 +90,17 @@ class WrapperHook:
     async def on_unfocus(self) -> None:
         """Will be run when the game window loses focus."""
 
+    def handles(self, method: str) -> bool:
+        """Returns False if the given event handler is known to do nothing."""
+        if getattr(type(self), method) is not getattr(WrapperHook, method):
+            return True
+        # the default on_start and on_stop call other handlers
+        delegate = _DEFAULT_DELEGATES.get(method)
+        return delegate is not None and self.handles(delegate)
+
+
+_DEFAULT_DELEGATES = {"on_start": "on_focus", "on_stop": "on_unfocus"}
+
 
 _REGISTERED_HOOKS: Dict[str, Type[WrapperHook]] = {}
 _LOADED_HOOKS: Dict[str, WrapperHook] = {}
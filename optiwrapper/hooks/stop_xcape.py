@@ -1,3 +1,7 @@
+import os
+import signal
+from typing import List
+
 from optiwrapper.hooks import WrapperHook
 from optiwrapper.lib import pgrep
 
@@ -6,12 +10,30 @@ class Hook(WrapperHook):
     """Suspend xcape while focused"""
 
     def __init__(self) -> None:
-        self.xcape_procs = pgrep("xcape .*Control_L", match_full=True)
+        # open pidfds up front, so each focus change is a single syscall per
+        # process (and can't hit an unrelated process if xcape exits)
+        self.xcape_pidfds: List[int] = []
+        for xcape_proc in pgrep("xcape .*Control_L", match_full=True):
+            try:
+                self.xcape_pidfds.append(os.pidfd_open(xcape_proc.pid))
+            except ProcessLookupError:
+                pass
+
+    def _send_signal(self, sig: signal.Signals) -> None:
+        for pidfd in self.xcape_pidfds:
+            try:
+                signal.pidfd_send_signal(pidfd, sig)
+            except ProcessLookupError:
+                pass
 
     async def on_focus(self) -> None:
-        for xcape_proc in self.xcape_procs:
-            xcape_proc.suspend()
+        self._send_signal(signal.SIGSTOP)
 
     async def on_unfocus(self) -> None:
-        for xcape_proc in self.xcape_procs:
-            xcape_proc.resume()
+        self._send_signal(signal.SIGCONT)
+
+    async def on_stop(self) -> None:
+        self._send_signal(signal.SIGCONT)
+        for pidfd in self.xcape_pidfds:
+            os.close(pidfd)
+        self.xcape_pidfds.clear()
@@ -3,16 +3,18 @@
 Common functions and variables used in multiple modules.
 """
 
+import asyncio
 import logging
 import os
 import re
-import sys
 from pathlib import Path
-from typing import Callable, Dict, Generator, Iterable, List, Optional
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Union
 
-from proc.core import Process, find_processes
-from Xlib import X, display, error
-from Xlib.protocol import event
+from Xlib import X, Xatom, display, error
+
+if TYPE_CHECKING:
+    from proc.core import Process
+    from Xlib.xobject.drawable import Window
 
 logger = logging.getLogger("optiwrapper")
 
@@ -20,7 +22,7 @@ logger = logging.getLogger("optiwrapper")
 WRAPPER_DIR = Path.home() / "Games/wrapper"
 SETTINGS_DIR = WRAPPER_DIR / "settings"
 
-# Used to tell focus thread to stop
+# Cleared once the game has stopped, so it's only logged once
 running = True
 
 
@@ -48,111 +50,242 @@ if not hasattr(os, "pidfd_open"):
         os.pidfd_open = _pidfd_open
 
 
-def watch_focus(
-    window_ids: Iterable[int],
-    focus_in_cb: Callable[[Optional[event.FocusIn]], None],
-    focus_out_cb: Callable[[Optional[event.FocusOut]], None],
-) -> Generator[int, None, None]:
-    """Watches for focus changes and executes callbacks.
+def get_window_manager_name() -> str:
+    """Finds the name of the running window manager, like `wmctrl -m` does.
+
+    Returns:
+        The name of the window manager, "N/A" if it doesn't have a name, or an
+        empty string if there's no EWMH-compliant window manager running.
+    """
+    try:
+        disp = display.Display()
+    except error.DisplayError:
+        return ""
+    try:
+        prop = disp.screen().root.get_full_property(
+            disp.intern_atom("_NET_SUPPORTING_WM_CHECK"), Xatom.WINDOW
+        )
+        if prop is None or not prop.value:
+            return ""
+        wm_window = disp.create_resource_object("window", prop.value[0])
+        return (
+            wm_window.get_full_text_property(disp.intern_atom("_NET_WM_NAME")) or "N/A"
+        )
+    except error.XError:
+        return ""
+    finally:
+        disp.close()
+
+
+class ActiveWindowWatcher:
+    """Watches for changes to the active window, from an asyncio event loop.
 
-    Watches for focus changes on all windows in `window_ids`, and executes the
-    corresponding callback with the specified event.
+    The window manager keeps the active window in the _NET_ACTIVE_WINDOW
+    property on the root window (and the list of managed windows in
+    _NET_CLIENT_LIST), so we only need to listen for property changes there.
 
     Args:
-        window_ids: A list of X window IDs to track.
-        focus_in_cb: A function to execute when a window gains focus. The focus
-            event will be passed as the first argument.
-        focus_out_cb: A function to execute when a window loses focus. The focus
-            event will be passed as the first argument.
-
-    Yields:
-        Each window ID when that window closes.
-        -1 if a window ID is invalid and returns early.
-        Returns early if game is stopped (lib.running changes to False)
+        callback: A function to execute when the active window changes. The
+            new active window ID (or X.NONE) will be passed as the first
+            argument.
+        clients_callback: An optional function to execute when windows are
+            added or removed. The IDs of all the managed windows will be
+            passed as the first argument.
     """
-    disp = display.Display()
-    focused = disp.get_input_focus().focus
-
-    # subscribe to focus events on each window
-    ec = error.CatchError(error.BadWindow)
-    for window_id in window_ids:
-        win = disp.create_resource_object("window", window_id)
-        win.change_attributes(
-            event_mask=X.FocusChangeMask | X.StructureNotifyMask, onerror=ec
-        )
-        disp.sync()
-        err = ec.get_error()
-        if err:
-            logger.error("Bad window ID: 0x%x", err.resource_id.id)
-            yield -1
-            return
-        if win == focused:
-            focus_in_cb(None)
-        else:
-            focus_out_cb(None)
-
-    # main loop
-    while running:
-        evt = disp.next_event()
-        if not running:
-            break
-        if evt.type == X.DestroyNotify:
-            logger.debug("window destroyed: 0x%x", evt.window.id)
-            yield int(evt.window.id)
-        if isinstance(evt, event.Focus):
-            if evt.mode not in (X.NotifyNormal, X.NotifyWhileGrabbed):
-                continue
-            if isinstance(evt, event.FocusIn) and focused != evt.window:
-                focus_in_cb(evt)
-                focused = evt.window
-            if (
-                isinstance(evt, event.FocusOut)
-                and focused == evt.window
-                and evt.detail != X.NotifyInferior
-            ):
-                focus_out_cb(evt)
-                focused = X.NONE
 
-    yield 0
+    def __init__(
+        self,
+        callback: Callable[[int], None],
+        clients_callback: Optional[Callable[[List[int]], None]] = None,
+    ):
+        self.callback = callback
+        self.clients_callback = clients_callback
+        self.disp = display.Display()
+        self._net_active_window = self.disp.intern_atom("_NET_ACTIVE_WINDOW")
+        self._net_client_list = self.disp.intern_atom("_NET_CLIENT_LIST")
+        self._net_wm_name = self.disp.intern_atom("_NET_WM_NAME")
+        self.root.change_attributes(event_mask=X.PropertyChangeMask)
+        self.disp.flush()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def root(self) -> "Window":
+        return self.disp.screen().root
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Starts dispatching events from `loop`."""
+        self._loop = loop
+        loop.add_reader(self.disp.fileno(), self._on_readable)
+
+    def close(self) -> None:
+        if self._loop is not None:
+            self._loop.remove_reader(self.disp.fileno())
+            self._loop = None
+        self.disp.close()
+
+    def active_window(self) -> int:
+        prop = self.root.get_full_property(self._net_active_window, Xatom.WINDOW)
+        if prop is None or not prop.value:
+            return X.NONE
+        return int(prop.value[0])
+
+    def client_windows(self) -> List[int]:
+        """Returns all the windows managed by the window manager."""
+        prop = self.root.get_full_property(self._net_client_list, Xatom.WINDOW)
+        if prop is None:
+            return []
+        return [int(window_id) for window_id in prop.value]
+
+    def window_title(self, window_id: int) -> str:
+        """Returns the title of a window.
+
+        Returns an empty string if the window doesn't exist anymore.
+        """
+        win = self.disp.create_resource_object("window", window_id)
+        try:
+            return (
+                win.get_full_text_property(self._net_wm_name)
+                or win.get_full_text_property(Xatom.WM_NAME)
+                or ""
+            )
+        except error.XError:
+            return ""
+
+    def window_class(self, window_id: int) -> str:
+        """Returns the class name (the first string in WM_CLASS) of a window.
+
+        Returns an empty string if the window doesn't exist anymore.
+        """
+        win = self.disp.create_resource_object("window", window_id)
+        try:
+            wm_class = win.get_wm_class()
+        except error.XError:
+            return ""
+        return wm_class[0] if wm_class else ""
+
+    def _on_readable(self) -> None:
+        # the callbacks make round trips to the X server, and any events that
+        # arrive in the meantime get queued by Xlib without the socket becoming
+        # readable again, so keep going until the queue is empty
+        while self.disp.pending_events():
+            active_changed = False
+            clients_changed = False
+            while self.disp.pending_events():
+                evt = self.disp.next_event()
+                if evt.type != X.PropertyNotify:
+                    continue
+                if evt.atom == self._net_active_window:
+                    active_changed = True
+                elif evt.atom == self._net_client_list:
+                    clients_changed = True
+            if clients_changed and self.clients_callback is not None:
+                self.clients_callback(self.client_windows())
+            if active_changed:
+                self.callback(self.active_window())
+
+
+# whether /proc/<pid>/task/<tid>/children exists (needs CONFIG_PROC_CHILDREN)
+_HAVE_PROC_CHILDREN = os.path.exists(f"/proc/self/task/{os.getpid()}/children")
+
+
+def descendant_pids(pid: int) -> Optional[List[int]]:
+    """Finds all the descendants of a process.
+
+    This reads `/proc/<pid>/task/<tid>/children`, which is only available if
+    the kernel was built with CONFIG_PROC_CHILDREN.
+
+    Returns:
+        A list of process IDs, or None if the children files aren't available.
+    """
+    if not _HAVE_PROC_CHILDREN:
+        return None
+    pids: List[int] = []
+    parents = [pid]
+    while parents:
+        parent = parents.pop()
+        try:
+            tids = os.listdir(f"/proc/{parent}/task")
+        except OSError:
+            # the process already exited
+            continue
+        for tid in tids:
+            try:
+                with open(f"/proc/{parent}/task/{tid}/children") as f:
+                    children = [int(child) for child in f.read().split()]
+            except OSError:
+                continue
+            pids.extend(children)
+            parents.extend(children)
+    return pids
 
 
-def pgrep(pattern: str, match_full: bool = False) -> List[Process]:
+def pgrep(
+    pattern: Union[str, "re.Pattern[str]"],
+    match_full: bool = False,
+    root_pid: Optional[int] = None,
+) -> List["Process"]:
     """Works like the pgrep command. Searches /proc for a matching process.
 
     Args:
-        pattern: A regular expression to match against.
+        pattern: A regular expression to match against, either as a string or
+            already compiled.
 
     Kwargs:
         match_full: If True, match against `/proc/<pid>/cmdline` instead of
             `/proc/<pid>/comm` (which is limited to 15 characters).
+        root_pid: If given, only search the descendants of this process,
+            instead of every process on the system.
 
     Returns:
         A list of matching processes.
     """
+    # only needed here, so don't import it at startup
+    from proc.core import Process  # pylint: disable=import-outside-toplevel
 
-    regex = re.compile(pattern)
-    own_pid = str(os.getpid())
+    regex = pattern if isinstance(pattern, re.Pattern) else re.compile(pattern)
+    own_pid = os.getpid()
 
-    procs = set()
-    for proc in find_processes():
-        if proc.pid == own_pid or not proc.cmdline:
+    pids = descendant_pids(root_pid) if root_pid is not None else None
+    if pids is None:
+        pids = [
+            int(entry.name) for entry in os.scandir("/proc") if entry.name.isdigit()
+        ]
+
+    procs = []
+    for pid in pids:
+        if pid == own_pid:
+            continue
+        # only read the command line here, and leave the rest of /proc/<pid>
+        # for the few processes that actually match
+        data = _read_cmdline(pid)
+        if not data:
             continue
 
         if match_full:
-            for val in proc.cmdline:
-                if regex.search(val) is not None:
-                    # found match
-                    procs.add(proc)
-                    break
-            if regex.search(" ".join(proc.cmdline)) is not None:
-                procs.add(proc)
+            cmdline = [os.fsdecode(arg) for arg in data.split(b"\0")]
+            matched = any(regex.search(val) is not None for val in cmdline) or (
+                regex.search(" ".join(cmdline)) is not None
+            )
         else:
-            # only match against argv[0]
-            if regex.search(proc.cmdline[0]) is not None:
-                # found match
-                procs.add(proc)
+            # only match against argv[0], so don't bother decoding the rest
+            argv0 = os.fsdecode(data.split(b"\0", 1)[0])
+            matched = regex.search(argv0) is not None
+        if matched:
+            proc = Process.from_pid(pid)
+            # the process may have exited in the meantime
+            if proc is not None:
+                procs.append(proc)
+
+    return procs
 
-    return list(procs)
+
+def _read_cmdline(pid: int) -> bytes:
+    """Returns the NUL-separated arguments of a process, without the trailing NUL."""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().rstrip(b"\0")
+    except OSError:
+        return b""
 
 
 def clean_ld_preload(is_64_bit: bool) -> Dict[str, str]:
@@ -165,52 +298,12 @@ def clean_ld_preload(is_64_bit: bool) -> Dict[str, str]:
     def is_good(entry: str) -> bool:
         return bad_lib not in entry and screensaver_fix not in entry
 
-    orig_entries = os.environ.get("LD_PRELOAD", "").split(":")
+    orig = os.environ.get("LD_PRELOAD", "")
+    if bad_lib not in orig and screensaver_fix not in orig:
+        return {}
+    orig_entries = orig.split(":")
     cleaned_entries = list(filter(is_good, orig_entries))
     if cleaned_entries != orig_entries:
         # need to override the environment variable
         return {"LD_PRELOAD": ":".join(cleaned_entries)}
     return {}
-
-
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <window id>")
-        sys.exit(1)
-
-    DETAIL_LUT = {
-        X.NotifyAncestor: "NotifyAncestor",
-        X.NotifyVirtual: "NotifyVirtual",
-        X.NotifyInferior: "NotifyInferior",
-        X.NotifyNonlinear: "NotifyNonlinear",
-        X.NotifyNonlinearVirtual: "NotifyNonlinearVirtual",
-        X.NotifyPointer: "NotifyPointer",
-        X.NotifyPointerRoot: "NotifyPointerRoot",
-        X.NotifyDetailNone: "NotifyDetailNone",
-    }
-
-    def focus_in(evt: Optional[event.FocusIn]) -> None:
-        """Prints message about the window that got focus."""
-        if evt is None:
-            return
-        cls = evt.window.get_wm_class() or ("", "")
-        print(
-            'Got  focus on window 0x{:07x} ({:s}) "{:s}"'.format(
-                evt.window.id, DETAIL_LUT[evt.detail], cls[1]
-            )
-        )
-
-    def focus_out(evt: Optional[event.FocusOut]) -> None:
-        """Prints message about the window that lost focus."""
-        if evt is None:
-            return
-        cls = evt.window.get_wm_class() or ("", "")
-        print(
-            'Lost focus on window 0x{:07x} ({:s}) "{:s}"'.format(
-                evt.window.id, DETAIL_LUT[evt.detail], cls[1]
-            )
-        )
-
-    sys.exit(
-        next(watch_focus([int(arg, 0) for arg in sys.argv[1:]], focus_in, focus_out))
-    )
@@ -218,9 +218,13 @@ def xdo_select_window_with_click(xdo: Optional[xdo_t] = None) -> Optional[int]:
     make_xdo = xdo is None
     if make_xdo:
         xdo = xdo_new(None)
-    return_code = _myxdo.xdo_select_window_with_click(xdo, byref(window_ret))
-    if make_xdo:
-        xdo_free(xdo)
+    try:
+        return_code = _myxdo.xdo_select_window_with_click(xdo, byref(window_ret))
+    finally:
+        # the errcheck callback raises on failure, so free the context (and
+        # its X connection) either way
+        if make_xdo:
+            xdo_free(xdo)
     if return_code == XDO_ERROR or window_ret.value == 0:
         return None
     return window_ret.value
@@ -332,9 +336,13 @@ def xdo_search_windows(
     make_xdo = xdo is None
     if make_xdo:
         xdo = xdo_new(None)
-    _myxdo.xdo_search_windows(xdo, search, byref(windowlist_ret), byref(nwindows_ret))
-    if make_xdo:
-        xdo_free(xdo)
+    try:
+        _myxdo.xdo_search_windows(
+            xdo, search, byref(windowlist_ret), byref(nwindows_ret)
+        )
+    finally:
+        if make_xdo:
+            xdo_free(xdo)
 
     # indexing a pointer returns the enclosed value
     return [windowlist_ret[i] for i in range(nwindows_ret.value)]
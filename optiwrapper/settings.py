@@ -2,25 +2,62 @@
 Manages loading and storing per-game configuration data.
 """
 
+import ctypes
 import dataclasses
-import itertools
+import functools
 import os
+import pickle
+import stat
+import struct
+import threading
 from dataclasses import dataclass, field
-from typing import Any, ClassVar, Dict, List, Optional, Union
+from pathlib import Path
+from types import MappingProxyType
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 import yaml
 
-from optiwrapper.lib import SETTINGS_DIR
+from optiwrapper.lib import SETTINGS_DIR, logger
 
+# use the libyaml bindings if PyYAML was built with them (this is what
+# pylibyaml does, without monkey-patching yaml)
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
 
-class ConfigFlags:
-    _defaults: ClassVar[Dict[str, bool]] = {
+# read-only, since the flag properties below bake these values in at import time
+_FLAG_DEFAULTS: Mapping[str, bool] = MappingProxyType(
+    {
         "use_gpu": False,
         "fallback": True,
         "use_primus": True,
         "vsync": True,
         "is_64_bit": True,
     }
+)
+
+
+class ConfigFlags:
+    _defaults: ClassVar[Mapping[str, bool]] = _FLAG_DEFAULTS
+    _fields: ClassVar[Tuple[str, ...]] = tuple(_defaults)
+
+    # the flag properties are generated below, from _FLAG_DEFAULTS
+    use_gpu: bool
+    fallback: bool
+    use_primus: bool
+    vsync: bool
+    is_64_bit: bool
 
     def __init__(self, **kwargs: bool):
         self._lookup: Dict[str, bool] = {}
@@ -34,7 +71,19 @@ class ConfigFlags:
                 )
             )
 
+    @classmethod
+    def default(cls) -> "ConfigFlags":
+        """Returns the shared instance with every flag at its default value.
+
+        This instance is shared between all configs without flag overrides, so
+        it should be treated as immutable. Use Config.mutable_flags() to get a
+        private copy before changing anything.
+        """
+        return _EMPTY_FLAGS
+
     def asdict(self) -> Dict[str, bool]:
+        if self is _EMPTY_FLAGS:
+            return {}
         return self._lookup
 
     def __bool__(self) -> bool:
@@ -42,23 +91,7 @@ class ConfigFlags:
 
     @property
     def fields(self) -> List[str]:
-        return list(self._defaults.keys())
-
-    def __getattr__(self, name: str) -> Any:
-        # this only gets called if `name` isn't an existing instance attribute
-        return self._lookup.get(name, self._defaults[name])
-
-    def __setattr__(self, name: str, value: bool) -> None:
-        if name in self._defaults:
-            self._lookup[name] = value
-        else:
-            super().__setattr__(name, value)
-
-    def __delattr__(self, name: str) -> None:
-        if name in self._defaults:
-            del self._lookup[name]
-        else:
-            super().__delattr__(name)
+        return list(self._fields)
 
     def __eq__(self, other: Any) -> bool:
         if not isinstance(other, ConfigFlags):
@@ -78,27 +111,273 @@ class ConfigFlags:
         return ConfigFlags(**self._lookup)
 
 
-@dataclass
+def _make_flag_property(name: str, default: bool) -> property:
+    def getter(self: ConfigFlags) -> bool:
+        # pylint: disable-next=protected-access
+        return self._lookup.get(name, default)
+
+    def setter(self: ConfigFlags, value: bool) -> None:
+        # pylint: disable-next=protected-access
+        self._lookup[name] = value
+
+    def deleter(self: ConfigFlags) -> None:
+        # pylint: disable-next=protected-access
+        del self._lookup[name]
+
+    return property(getter, setter, deleter)
+
+
+def _install_flag_properties() -> None:
+    for name, default in _FLAG_DEFAULTS.items():
+        setattr(ConfigFlags, name, _make_flag_property(name, default))
+
+
+_install_flag_properties()
+
+
+_EMPTY_FLAGS = ConfigFlags()
+
+
+@functools.lru_cache(maxsize=None)
+def _log_yaml_loader() -> None:
+    """Logs which YAML loader is used, the first time a file is parsed."""
+    if _YamlLoader is yaml.SafeLoader:
+        logger.debug("PyYAML was built without libyaml, using the slow loader")
+    else:
+        logger.debug("parsing settings with %s", _YamlLoader.__name__)
+
+
+@functools.lru_cache(maxsize=256)
+def _load_cached(path: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    """Parses a settings file.
+
+    The modification time and size are used as the cache key, so the file is
+    parsed again after it changes. Besides this in-memory cache, the parsed
+    data is pickled to a hidden file next to the settings file, so new
+    processes can skip parsing the YAML as well.
+    """
+    cache_path = os.path.join(
+        os.path.dirname(path), "." + os.path.basename(path) + ".cache"
+    )
+    try:
+        with open(cache_path, "rb") as f:
+            cache_key, data = pickle.load(f)
+        if cache_key == (mtime_ns, size):
+            return data
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        pass
+
+    _log_yaml_loader()
+    with open(path) as f:
+        data = yaml.load(f, Loader=_YamlLoader)
+    if data is None:
+        data = {}
+
+    # write to a temporary file first, so other processes never see a partial
+    # cache file
+    tmp_path = f"{cache_path}.{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(((mtime_ns, size), data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # don't leave a partial temporary file behind (e.g. if the disk is full)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+    return data
+
+
+def _load_path(path: Path) -> Dict[str, Any]:
+    watcher = _WATCHER
+    if watcher is not None:
+        return watcher.load(path)
+    st = path.stat()
+    return _load_cached(str(path), st.st_mtime_ns, st.st_size)
+
+
+# from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_CLOEXEC = os.O_CLOEXEC
+
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class _SettingsWatcher(threading.Thread):
+    """Keeps parsed settings files in memory until inotify reports a change.
+
+    Files that haven't changed since they were last loaded are returned
+    without calling stat() at all.
+    """
+
+    def __init__(self, fd: int):
+        super().__init__(name="settings-watcher")
+        self.daemon = True
+        self.fd = fd
+        self.lock = threading.Lock()
+        # incremented for every change to a settings file, to detect changes
+        # that happen while a file is being loaded
+        self.generation = 0
+        self.running = True
+        self.fresh: Dict[str, Dict[str, Any]] = {}
+
+    def load(self, path: Path) -> Dict[str, Any]:
+        data = self.fresh.get(path.name)
+        if data is not None:
+            return data
+        generation = self.generation
+        st = path.stat()
+        data = _load_cached(str(path), st.st_mtime_ns, st.st_size)
+        with self.lock:
+            if self.running and generation == self.generation:
+                self.fresh[path.name] = data
+        return data
+
+    def run(self) -> None:
+        global _WATCHER  # pylint: disable=global-statement
+        while self.running:
+            try:
+                buf = os.read(self.fd, 4096)
+            except OSError:
+                buf = b""
+            if not buf:
+                break
+            with self.lock:
+                offset = 0
+                while offset < len(buf):
+                    _, mask, _, name_len = _INOTIFY_EVENT.unpack_from(buf, offset)
+                    offset += _INOTIFY_EVENT.size
+                    name = os.fsdecode(buf[offset : offset + name_len].rstrip(b"\0"))
+                    offset += name_len
+                    if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF | _IN_IGNORED):
+                        # the directory itself is gone, so we can't keep watching
+                        self.running = False
+                    if mask & _IN_Q_OVERFLOW:
+                        self.generation += 1
+                        self.fresh.clear()
+                    elif name.endswith(".yaml"):
+                        self.generation += 1
+                        self.fresh.pop(name, None)
+        # fall back to checking the modification time on every load
+        with self.lock:
+            self.running = False
+            self.fresh.clear()
+        if _WATCHER is self:
+            _WATCHER = None
+        os.close(self.fd)
+
+
+_WATCHER: Optional[_SettingsWatcher] = None
+
+
+def watch_settings_dir() -> bool:
+    """Starts watching the settings directory for changes using inotify.
+
+    While the directory is being watched, loading an unchanged settings file
+    doesn't touch the filesystem. Only worth it for long-running processes.
+
+    Returns True if the watch was set up, or False if inotify isn't available.
+    """
+    global _WATCHER  # pylint: disable=global-statement
+    if _WATCHER is not None:
+        return True
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return False
+    fd = inotify_init1(_IN_CLOEXEC)
+    if fd < 0:
+        return False
+    mask = (
+        _IN_MODIFY
+        | _IN_CLOSE_WRITE
+        | _IN_MOVED_FROM
+        | _IN_MOVED_TO
+        | _IN_CREATE
+        | _IN_DELETE
+        | _IN_DELETE_SELF
+        | _IN_MOVE_SELF
+    )
+    if inotify_add_watch(fd, os.fsencode(SETTINGS_DIR), mask) < 0:
+        os.close(fd)
+        return False
+    _WATCHER = _SettingsWatcher(fd)
+    _WATCHER.start()
+    return True
+
+
+@dataclass(eq=False, slots=True)
 class Config:
+    # command and hooks default to a shared empty tuple, and are only turned
+    # into a list when they need to be modified (see _mutable_list())
     game: str
-    command: List[str] = field(default_factory=list)
-    flags: ConfigFlags = field(default_factory=ConfigFlags)
+    command: Sequence[str] = ()
+    flags: ConfigFlags = field(default_factory=ConfigFlags.default)
     process_name: str = ""
     window_title: str = ""
     window_class: str = ""
-    hooks: List[str] = field(default_factory=list)
+    hooks: Sequence[str] = ()
 
     @classmethod
     def load(cls, game: str) -> "Config":
         path = SETTINGS_DIR / f"{game}.yaml"
-        with open(path) as f:
-            data = yaml.safe_load(f)
-        if data is None:
-            data = {}
+        return cls._from_data(game, _load_path(path))
+
+    @classmethod
+    def load_all(cls) -> Dict[str, "Config"]:
+        """Loads the configuration for every game in the settings directory.
 
-        if "flags" in data:
-            data["flags"] = ConfigFlags(**data["flags"])
-        return cls(game, **data)
+        The results are cached for later calls to Config.load().
+        """
+        return {
+            path.stem: cls._from_data(path.stem, _load_path(path))
+            for path in sorted(SETTINGS_DIR.glob("*.yaml"))
+        }
+
+    @classmethod
+    def _from_data(cls, game: str, data: Dict[str, Any]) -> "Config":
+        # the parsed data is shared through the cache, so copy anything mutable
+        kwargs = data.copy()
+        flags = kwargs.pop("flags", None)
+        for key in ("command", "hooks"):
+            if key in kwargs:
+                kwargs[key] = list(kwargs[key])
+        if flags:
+            kwargs["flags"] = ConfigFlags(**flags)
+        return cls(game, **kwargs)
+
+    def mutable_flags(self) -> ConfigFlags:
+        """Returns the flags for this config, ready to be modified.
+
+        If the flags are currently the shared default instance, they are
+        replaced with a private copy first.
+        """
+        if self.flags is _EMPTY_FLAGS:
+            self.flags = self.flags.copy()
+        return self.flags
+
+    def mutable_hooks(self) -> List[str]:
+        """Returns the hooks for this config, ready to be modified."""
+        return self._mutable_list("hooks")
+
+    def _mutable_list(self, name: str) -> List[str]:
+        val = getattr(self, name)
+        if not isinstance(val, list):
+            val = list(val)
+            setattr(self, name, val)
+        return val
 
     def check(self) -> Optional[str]:
         """Checks if this configuration is valid.
@@ -111,11 +390,19 @@ class Config:
 
         # the command must be a valid executable
         program = self.command[0]
-        if not os.path.isfile(program):
+        try:
+            mode = os.stat(program).st_mode
+        except (OSError, ValueError):
+            mode = 0
+        if not stat.S_ISREG(mode):
             if os.sep not in program:
                 return f'The file "{program}" specified for command does not exist (it should be a full path).'
             return f'The file "{program}" specified for command does not exist.'
-        if not os.access(program, os.X_OK):
+        # the mode can only rule execution out: ownership, ACLs and noexec
+        # mounts still have to be checked by the kernel
+        if not mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH) or not os.access(
+            program, os.X_OK
+        ):
             return f'The file "{program}" specified for command is not executable.'
 
         return None
@@ -131,54 +418,99 @@ class Config:
                 continue
             if isinstance(val, ConfigFlags):
                 val = val.asdict()
+            elif isinstance(val, tuple):
+                val = list(val)
             d[fld.name] = val
         return d
 
+    def __eq__(self, other: Any) -> bool:
+        # compare what would be saved, so e.g. an empty tuple and an empty list
+        # are treated the same
+        if not isinstance(other, Config):
+            return NotImplemented
+        return self.game == other.game and self.asdict() == other.asdict()
+
     def save(self) -> None:
+        # the flags are written by hand, so split the rest of the fields into
+        # the ones that come before and after them
+        before: Dict[str, Any] = {}
+        after: Dict[str, Any] = {}
+        flags: Optional[Dict[str, bool]] = None
+        for key, val in self.asdict().items():
+            if key == "flags":
+                assert isinstance(val, dict)
+                flags = val
+            elif flags is None:
+                before[key] = val
+            else:
+                after[key] = val
+
         path = SETTINGS_DIR / f"{self.game}.yaml"
         with open(path, "w") as f:
-            yaml.dump(
-                self.asdict(),
-                f,
-                default_flow_style=False,
-                allow_unicode=True,
-                sort_keys=False,
-            )
+            if before:
+                _dump_yaml(before, f)
+            if flags:
+                f.write(_render_flags(flags))
+            if after:
+                _dump_yaml(after, f)
 
     def copy(self) -> "Config":
         return Config(
             self.game,
-            self.command.copy(),
+            _copy_seq(self.command),
             self.flags.copy(),
             self.process_name,
             self.window_title,
             self.window_class,
-            self.hooks.copy(),
+            _copy_seq(self.hooks),
         )
 
     def pretty(self) -> str:
         """Pretty-formats this Config object."""
-        out = []
-        option_width = (
-            max(
-                len(fld)
-                for fld in itertools.chain(
-                    (x.name for x in dataclasses.fields(self)),
-                    self.flags.fields,
-                )
-            )
-            + 1
+
+        def items() -> Iterator[Tuple[str, Any]]:
+            for name in _CONFIG_FIELD_NAMES:
+                val = getattr(self, name)
+                if isinstance(val, ConfigFlags):
+                    for flag_name in val.fields:
+                        yield flag_name, getattr(val, flag_name)
+                elif isinstance(val, tuple):
+                    yield name, list(val)
+                else:
+                    yield name, val
+
+        return "\n".join(
+            f"{name + ':':<{_PRETTY_WIDTH}s} {val}" for name, val in items()
         )
 
-        def fmt(name: str, value: Any) -> str:
-            return "{:<{width}s} {}".format(name + ":", value, width=option_width)
 
-        for fld in dataclasses.fields(self):
-            val = getattr(self, fld.name)
-            if isinstance(val, ConfigFlags):
-                for flag_name in self.flags.fields:
-                    flag_val = getattr(self.flags, flag_name)
-                    out.append(fmt(flag_name, flag_val))
-            else:
-                out.append(fmt(fld.name, val))
-        return "\n".join(out)
+def _dump_yaml(data: Dict[str, Any], stream: TextIO) -> None:
+    yaml.dump(
+        data,
+        stream,
+        Dumper=_YamlDumper,
+        default_flow_style=False,
+        allow_unicode=True,
+        sort_keys=False,
+    )
+
+
+def _render_flags(flags: Dict[str, bool]) -> str:
+    """Formats the flags mapping the same way yaml.dump() would."""
+    lines = ["flags:\n"]
+    lines.extend(
+        f"  {name}: {'true' if val else 'false'}\n" for name, val in flags.items()
+    )
+    return "".join(lines)
+
+
+def _copy_seq(seq: Sequence[str]) -> Sequence[str]:
+    # tuples are immutable, so they can be shared
+    if isinstance(seq, tuple):
+        return seq
+    return list(seq)
+
+
+_CONFIG_FIELD_NAMES = tuple(fld.name for fld in dataclasses.fields(Config))
+_ALL_NAMES = _CONFIG_FIELD_NAMES + ConfigFlags._fields
+_PRETTY_WIDTH = max(map(len, _ALL_NAMES)) + 1
@@ -7,39 +7,45 @@ playtime, and more.
 import argparse
 import asyncio
 import enum
+import json
 import logging
 import os
+import re
+import shutil
 import signal
 import subprocess
 import sys
-import threading
 import time
 from dataclasses import dataclass
+from datetime import datetime
 from pathlib import Path
 from typing import (
+    TYPE_CHECKING,
     Any,
+    Awaitable,
     Callable,
     Coroutine,
     Dict,
     List,
     NoReturn,
     Optional,
+    Sequence,
     Set,
     Tuple,
     TypeVar,
     Union,
 )
 
-import arrow
-import dbus_next
-import desktop_notify
-import pyprctl
+import Xlib.error
 
 from optiwrapper import hooks, lib
-from optiwrapper.lib import SETTINGS_DIR, WRAPPER_DIR, logger, pgrep, watch_focus
-from optiwrapper.libxdo import xdo_free, xdo_new, xdo_search_windows
+from optiwrapper.focus import FocusTracker
+from optiwrapper.lib import SETTINGS_DIR, WRAPPER_DIR, logger, pgrep
 from optiwrapper.settings import Config
 
+if TYPE_CHECKING:
+    import desktop_notify
+
 
 class GpuType(enum.Enum):
     UNKNOWN = enum.auto()
@@ -62,6 +68,11 @@ class ExitCode(enum.Enum):
 # constants
 WINDOW_WAIT_TIME = 120
 PROCESS_WAIT_TIME = 20
+PROCESS_POLL_INTERVAL = 0.5
+GPU_CACHE_FILE = Path.home() / ".cache/optiwrapper/gpu.json"
+GPU_CACHE_TTL = 60 * 60
+DGPU_CONF = "/etc/X11/xorg.conf.d/20-dgpu.conf"
+VK_ICD_DIR = "/usr/share/vulkan/icd.d/"
 
 
 # logging
@@ -86,9 +97,6 @@ def handle_exception(exc_type, exc_value, exc_traceback):
 sys.excepthook = handle_exception
 
 
-pyprctl.set_child_subreaper(True)
-
-
 DESC = """
 A generic game wrapper script that can run the game on the discrete GPU, turn
 off xcape while the game is focused, log playtime, and more.
@@ -148,30 +156,94 @@ class Event(enum.Enum):
     DIE = enum.auto()
 
 
-def get_gpu_type(needs_gpu: bool) -> GpuType:
+HOOK_METHODS = ("on_start", "on_stop", "on_focus", "on_unfocus")
+
+TIME_LOG_MESSAGES = {
+    Event.START: "game started",
+    Event.STOP: "game stopped",
+    Event.UNFOCUS: "user left",
+    Event.FOCUS: "user returned",
+    Event.DIE: "wrapper died",
+}
+
+
+def get_gpu_type(needs_gpu: bool, use_cache: bool = True) -> GpuType:
     # construct_command_line
     if os.environ.get("NVIDIA_XRUN") is not None:
         return GpuType.NVIDIA
-    if (
-        os.readlink("/etc/X11/xorg.conf.d/20-dgpu.conf")
-        == "/etc/X11/video/20-nvidia.conf"
-    ):
+    try:
+        dgpu_conf = os.readlink(DGPU_CONF)
+    except OSError:
+        # missing, or not a symlink
+        dgpu_conf = None
+    if dgpu_conf == "/etc/X11/video/20-nvidia.conf":
         return GpuType.PRIME
 
     # from main
     if needs_gpu:
+        return _probe_bumblebee(use_cache)
+    return GpuType.UNKNOWN
+
+
+def _probe_bumblebee(use_cache: bool) -> GpuType:
+    """Returns BUMBLEBEE if optirun is installed and works, otherwise INTEL."""
+    optirun = shutil.which("optirun")
+    if optirun is None:
+        return GpuType.INTEL
+    # running optirun is slow, so reuse a recent result if we have one
+    if use_cache:
+        cached = read_gpu_cache(optirun)
+        if cached is not None:
+            logger.debug("using cached GPU type from %s", GPU_CACHE_FILE)
+            return cached
+
+    try:
+        optirun_works = (
+            subprocess.run([optirun, "--silent", "true"], check=False).returncode == 0
+        )
+    except FileNotFoundError:
+        optirun_works = False
+
+    if not optirun_works:
+        # don't cache this, so bumblebee gets another chance next launch
+        return GpuType.INTEL
+    write_gpu_cache(GpuType.BUMBLEBEE, optirun)
+    return GpuType.BUMBLEBEE
+
+
+def read_gpu_cache(optirun: str) -> Optional[GpuType]:
+    """
+    Returns the GPU type saved by write_gpu_cache(), or None if there isn't a
+    valid one for the given optirun executable.
+    """
+    try:
+        cache_mtime = GPU_CACHE_FILE.stat().st_mtime
+        if time.time() - cache_mtime >= GPU_CACHE_TTL:
+            return None
+        # the GPU setup may have changed since the cache was written
         try:
-            optirun_works = (
-                subprocess.run(["optirun", "--silent", "true"], check=True).returncode
-                == 0
-            )
+            if os.stat(DGPU_CONF, follow_symlinks=False).st_mtime > cache_mtime:
+                return None
         except FileNotFoundError:
-            optirun_works = False
+            pass
+        with open(GPU_CACHE_FILE) as f:
+            data = json.load(f)
+        if data.get("optirun") != optirun:
+            return None
+        return GpuType[data["gpu_type"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
 
-        if optirun_works:
-            return GpuType.BUMBLEBEE
-        return GpuType.INTEL
-    return GpuType.UNKNOWN
+
+def write_gpu_cache(gpu_type: GpuType, optirun: str) -> None:
+    try:
+        GPU_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(GPU_CACHE_FILE, "w") as f:
+            json.dump(
+                {"gpu_type": gpu_type.name, "optirun": optirun, "ts": time.time()}, f
+            )
+    except OSError:
+        logger.debug("failed to write GPU cache", exc_info=True)
 
 
 def dump_test_config(config: Config) -> str:
@@ -179,7 +251,7 @@ def dump_test_config(config: Config) -> str:
     Dumps a set of config files for comparing against the bash script.
     """
     out = []
-    out.append("COMMAND: " + " ".join(map(str, config.command)))
+    out.append(f"COMMAND: {' '.join(config.command)}")
 
     out.append("OUTPUT_FILES:")
     for outfile in sorted(LOGFILES):
@@ -192,13 +264,14 @@ def dump_test_config(config: Config) -> str:
 
     def dump(name: str) -> None:
         option = name.upper()
-        val: Union[str, List[str]] = getattr(config, name)
+        val: Union[str, Sequence[str]] = getattr(config, name)
         if not val:
             out.append(f"{option}:")
         elif isinstance(val, (str, Path)):
             out.append(f'{option}: "{val}"')
-        elif isinstance(val, list):
-            out.append("{}: {}".format(option, " ".join(map('"{:s}"'.format, val))))
+        elif isinstance(val, (list, tuple)):
+            quoted = " ".join(f'"{v}"' for v in val)
+            out.append(f"{option}: {quoted}")
 
     dump("game")
     dump_flag("use_gpu")
@@ -217,13 +290,17 @@ def setup_logfile(logfile: Any) -> None:
     """
     Adds a log file to the logger.
     """
-    logpath = Path(logfile).resolve(strict=False)
-    if str(logpath) not in LOGFILES:
+    if os.path.isabs(logfile):
+        # no need to walk the filesystem for paths we built ourselves
+        logpath = os.path.normpath(logfile)
+    else:
+        logpath = str(Path(logfile).resolve(strict=False))
+    if logpath not in LOGFILES:
         handler = logging.FileHandler(logpath, mode="w")
         handler.setLevel(logging.DEBUG)
         handler.setFormatter(LOGFILE_FORMATTER)
         logger.addHandler(handler)
-        LOGFILES.add(str(logpath))
+        LOGFILES.add(logpath)
 
 
 def construct_command_line(
@@ -250,7 +327,7 @@ def construct_command_line(
             if logger.isEnabledFor(logging.DEBUG):
                 cmd_args.append("--debug")
             if config.flags.use_primus:
-                cmd_args.extend("-b primus".split())
+                cmd_args.extend(("-b", "primus"))
     else:
         vk_icd_filenames = [
             "radeon_icd.x86_64.json",
@@ -259,31 +336,50 @@ def construct_command_line(
             # "intel_icd.x86_64.json",
             # "intel_hasvk_icd.x86_64.json",
         ]
-    environ["VK_ICD_FILENAMES"] = ":".join(
-        "/usr/share/vulkan/icd.d/" + filename for filename in vk_icd_filenames
+    environ["VK_ICD_FILENAMES"] = os.pathsep.join(
+        VK_ICD_DIR + filename for filename in vk_icd_filenames
     )
     if config.command:
         cmd_args.extend(config.command)
     return cmd_args, environ
 
 
+NOTIFY_ICONS = {
+    logging.INFO: "dialog-information",
+    logging.WARNING: "dialog-warning",
+    logging.ERROR: "dialog-error",
+}
+# desktop_notify.aio.Server has no way to close its DBus connection (its
+# close() dismisses a notification), so this is left to process exit: run()
+# calls sys.exit() as soon as the event loop finishes
+_NOTIFY_SERVER: Optional["desktop_notify.aio.Server"] = None
+
+
 async def notify(msg: str, level: int = logging.INFO, log: bool = False) -> None:
-    icon = {
-        logging.INFO: "dialog-information",
-        logging.WARNING: "dialog-warning",
-        logging.ERROR: "dialog-error",
-    }.get(level, "dialog-information")
+    global _NOTIFY_SERVER  # pylint: disable=global-statement
+    # these pull in the whole DBus stack, and are only needed if something goes
+    # wrong, so don't import them at startup
+    # pylint: disable=import-outside-toplevel
+    import dbus_next
+    import desktop_notify
+
+    icon = NOTIFY_ICONS.get(level, "dialog-information")
     if log:
         logger.log(level, msg)
     try:
-        server = desktop_notify.aio.Server("optiwrapper")
+        # reuse the same server (and DBus connection) for every notification
+        if _NOTIFY_SERVER is None:
+            _NOTIFY_SERVER = desktop_notify.aio.Server("optiwrapper")
+        server = _NOTIFY_SERVER
         notification = server.Notify("optiwrapper", msg, icon)
         await notification.show()
     except dbus_next.DBusError:
         logger.exception("Displaying notification failed")
+        # connect again next time, in case the connection itself is broken
+        _NOTIFY_SERVER = None
 
 
-_BACKGROUND_TASKS = set()
+_BACKGROUND_TASKS: Set[asyncio.Task[Any]] = set()
 
 _T = TypeVar("_T")
 
@@ -301,127 +397,66 @@ def create_background_task(
     return task
 
 
-class FocusThread(threading.Thread):
-    def __init__(self, main: "Main", loop: asyncio.AbstractEventLoop):
-        super().__init__()
-        self.main = main
-        self.loop = loop
-        self.daemon = True
-        self.kwargs: Dict[str, Union[bool, int, str]] = {
-            "only_visible": True,
-            "require_all": True,  # require all conditions to match
-        }
-
-        self.track_focus = False
-        if main.cfg.window_title:
-            self.kwargs["winname"] = main.cfg.window_title
-            self.track_focus = True
-        if main.cfg.window_class:
-            self.kwargs["winclassname"] = "^(" + main.cfg.window_class + ")$"
-            self.track_focus = True
-
-        self.in_window_manager = bool(main.window_manager)
-        if not self.in_window_manager:
-            logger.debug("not in WM")
-
-    def call_handler(self, handler: Callable[..., Coroutine[Any, Any, None]]) -> None:
-        self.loop.call_soon_threadsafe(create_background_task, handler(arrow.now()))
-
-    def run(self) -> None:
-        if not self.track_focus:
-            return
-        if not self.in_window_manager:
-            self.call_handler(self.main.focused)
-            return
-        logger.debug("in WM, tracking focus")
-
-        # if a window is closed, search for new matching windows again
-        closed_win = 1
-        logger.debug("waiting for window...")
-        while closed_win > 0 and lib.running:
-            xdo = xdo_new(None)
-            wins = xdo_search_windows(xdo, **self.kwargs)  # type: ignore[arg-type]
-            window_start_time = time.time()
-            while not wins and lib.running:
-                if time.time() > window_start_time + WINDOW_WAIT_TIME:
-                    self.loop.call_soon_threadsafe(
-                        create_background_task,
-                        notify(
-                            f"Window not found within {WINDOW_WAIT_TIME} seconds",
-                            logging.ERROR,
-                            log=True,
-                        ),
-                    )
-                    self.loop.call_soon_threadsafe(
-                        self.main.trigger_exit, ExitCode.NO_GAME_WINDOW
-                    )
-                    return
-                time.sleep(0.1)
-                wins = xdo_search_windows(xdo, **self.kwargs)  # type: ignore[arg-type]
-            xdo_free(xdo)
-            xdo = None
-            if not lib.running:
-                logger.debug("game stopped; focus thread exiting")
-                return
-            if len(wins) > 1:
-                logger.error(
-                    "found multiple windows (%s): can't track focus correctly",
-                    ", ".join(map("0x{:x}".format, wins)),
-                )
-                return
-            logger.debug("found window: 0x%x", wins[0])
-            closed_win = next(
-                watch_focus(
-                    wins,
-                    lambda evt: self.call_handler(self.main.focused),
-                    lambda evt: self.call_handler(self.main.unfocused),
-                )
-            )
-            logger.debug("watch_focus returned %x", closed_win)
-            time.sleep(0.1)
-        if closed_win <= 0:
-            logger.debug("window closed")
-
-
 class Main:  # pylint: disable=too-many-instance-attributes
     cfg: Config
     gpu_type: GpuType
     time_logfile: Path
+    time_fd: int
+    time_log_suffix: str
     window_manager: str
     command: List[str]
     env_override: Dict[str, str]
+    child_env: Dict[str, str]
     exit_code: ExitCode
+    # set once run() starts
+    loop: asyncio.AbstractEventLoop
     stop_event: asyncio.Event
     subprocess_task: Optional[asyncio.Task[int]]
+    child_watcher: Optional[asyncio.PidfdChildWatcher]
+    track_focus: bool
+    focus_tracker: Optional[FocusTracker]
+    # bound hook event handlers, by method name
+    hook_handlers: Dict[str, Tuple[Tuple[str, Callable[[], Awaitable[None]]], ...]]
 
-    def __init__(self, cfg: Config) -> None:
+    def __init__(self, cfg: Config, use_gpu_cache: bool = True) -> None:
         self.cfg = cfg
 
-        self.gpu_type = get_gpu_type(needs_gpu=self.cfg.flags.use_gpu)
+        self.gpu_type = get_gpu_type(
+            needs_gpu=self.cfg.flags.use_gpu, use_cache=use_gpu_cache
+        )
         logger.debug("GPU: %s", self.gpu_type)
 
         # setup time logging
         self.time_logfile = WRAPPER_DIR / f"time/{self.cfg.game}.log"
         # create directory if it doesn't exist
         self.time_logfile.parent.mkdir(parents=True, exist_ok=True)
-
-        # check if we're in a WM
-        wmctrl_proc = subprocess.run(
-            ["wmctrl", "-m"],
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        try:
-            self.window_manager = wmctrl_proc.stdout.splitlines()[0].partition(": ")[2]
-        except IndexError:
-            self.window_manager = ""
+        # opened on the first write, and kept open until the wrapper exits
+        self.time_fd = -1
+        self.time_log_suffix = ""
+        if self.cfg.game == "Minecraft" and "INST_ID" in os.environ:
+            self.time_log_suffix = f" (instance: {os.environ['INST_ID']})"
 
         self.command = []
         self.env_override = {}
+        self.child_env = {}
         self.exit_code = ExitCode.SUCCESS
         self.stop_event = asyncio.Event()
         self.subprocess_task = None
+        self.child_watcher = None
+
+        # focus tracking
+        self.track_focus = bool(self.cfg.window_title or self.cfg.window_class)
+        # check if we're in a WM (only focus tracking and hooks care, so don't
+        # connect to the X server otherwise)
+        self.window_manager = (
+            lib.get_window_manager_name() if self.track_focus or self.cfg.hooks else ""
+        )
+        self._process_re = (
+            re.compile(self.cfg.process_name) if self.cfg.process_name else None
+        )
+        self.focus_tracker = None
+
+        self.hook_handlers = {method: () for method in HOOK_METHODS}
 
     async def finish_setup(self) -> None:
         # check if discrete GPU works, notify if not
@@ -436,7 +471,7 @@ class Main:  # pylint: disable=too-many-instance-attributes
                     logging.ERROR,
                     True,
                 )
-                self.cfg.flags.use_gpu = False
+                self.cfg.mutable_flags().use_gpu = False
             else:
                 await notify("Discrete GPU not working, quitting", logging.ERROR, True)
                 self.trigger_exit(ExitCode.NO_GPU)
@@ -446,7 +481,8 @@ class Main:  # pylint: disable=too-many-instance-attributes
         #     print(dump_test_config(cfg))
         #     sys.exit(0)
 
-        logger.debug("\n%s", self.cfg.pretty())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("\n%s", self.cfg.pretty())
 
         # load hooks
         hooks.register_hooks()
@@ -457,22 +493,40 @@ class Main:  # pylint: disable=too-many-instance-attributes
                 gpu_type=self.gpu_type,
                 window_manager=self.window_manager,
             )
+        # skip the handlers that hooks don't override, so e.g. focus changes
+        # don't do anything if no hook cares about them
+        loaded_hooks = hooks.get_loaded_hooks()
+        self.hook_handlers = {
+            method: tuple(
+                (name, getattr(hook, method))
+                for name, hook in loaded_hooks.items()
+                if hook.handles(method)
+            )
+            for method in HOOK_METHODS
+        }
 
         # setup command
         self.command, self.env_override = construct_command_line(
             self.cfg, self.gpu_type
         )
-        logger.debug("Command: %s", repr(self.command))
+        logger.debug("Command: %r", self.command)
 
         # remove overlay library for wrong architecture and disable screensaver fix
         self.env_override.update(lib.clean_ld_preload(self.cfg.flags.is_64_bit))
         if "LD_PRELOAD" in self.env_override:
             logger.debug('Fixed LD_PRELOAD: now "%s"', self.env_override["LD_PRELOAD"])
 
-        logger.debug(
-            "env vars: %s",
-            " ".join(k + "=" + v for k, v in self.env_override.items()),
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "env vars: %s",
+                " ".join(k + "=" + v for k, v in self.env_override.items()),
+            )
+        self.child_env = os.environ | self.env_override
+
+        if self.cfg.process_name:
+            # used to wait on the game process once it's found
+            self.child_watcher = asyncio.PidfdChildWatcher()
+            self.child_watcher.attach_loop(self.loop)
         logger.debug("CWD: %s", Path().absolute())
         if self.cfg.game == "Minecraft" and "INST_NAME" in os.environ:
             logger.debug(
@@ -482,6 +536,7 @@ class Main:  # pylint: disable=too-many-instance-attributes
             )
 
     async def run(self) -> None:
+        self.loop = asyncio.get_running_loop()
         await self.finish_setup()
         if self.stop_event.is_set():
             return
@@ -494,14 +549,13 @@ class Main:  # pylint: disable=too-many-instance-attributes
             await self.stopped(killed=True)
             self.trigger_exit(ExitCode.KILLED)
 
+        def signal_handler(signame: str) -> None:
+            create_background_task(cb_signal_handler(signame))
+
         # clean up when killed by a signal
-        loop = asyncio.get_event_loop()
         for signame in ("SIGINT", "SIGTERM"):
-            loop.add_signal_handler(
-                getattr(signal, signame),
-                lambda signame=signame: create_background_task(
-                    cb_signal_handler(signame)
-                ),
+            self.loop.add_signal_handler(
+                getattr(signal, signame), signal_handler, signame
             )
 
         await self.started()
@@ -511,14 +565,18 @@ class Main:  # pylint: disable=too-many-instance-attributes
                 self.subprocess_task.cancel()
             if lib.running:
                 await self.stopped()
-            # finish all pending background tasks
-            await asyncio.gather(
-                *asyncio.all_tasks() - {asyncio.current_task()}, return_exceptions=True
-            )
+            # finish all pending background tasks (copied, since finished tasks
+            # remove themselves from the set)
+            await asyncio.gather(*list(_BACKGROUND_TASKS), return_exceptions=True)
         finally:
             # try to make sure we write a stop event to the time log
             if lib.running:
                 await self.stopped()
+            if self.time_fd >= 0:
+                os.close(self.time_fd)
+                self.time_fd = -1
+            if self.child_watcher is not None:
+                self.child_watcher.close()
 
     # pylint 2.17.4 says asyncio.subprocess.Process doesn't exist
     async def wait_for_process(self, process: "asyncio.subprocess.Process") -> int:
@@ -532,17 +590,28 @@ class Main:  # pylint: disable=too-many-instance-attributes
         self.trigger_exit(ExitCode.SUCCESS)
         return returncode
 
-    async def find_process(
-        self, launcher: "asyncio.subprocess.Process", loop: asyncio.AbstractEventLoop
-    ) -> int:
+    async def find_process(self, launcher: "asyncio.subprocess.Process") -> int:
         # wait on the launcher process in the background, to avoid zombies
         launcher_task = create_background_task(launcher.wait())
         # find process by name
-        pattern = self.cfg.process_name
-        proc_start_time = time.time()
+        pattern = self._process_re
+        assert pattern is not None
+        deadline = self.loop.time() + PROCESS_WAIT_TIME
+        # poll quickly at first, then back off to PROCESS_POLL_INTERVAL
+        interval = PROCESS_POLL_INTERVAL / 8
         procs: List[lib.Process] = []
         while len(procs) != 1:
-            if time.time() > proc_start_time + PROCESS_WAIT_TIME:
+            launcher_exited = launcher_task.done()
+            if launcher_exited and lib.descendant_pids(os.getpid()) == []:
+                # the game can't show up anymore, so don't wait for the timeout
+                logger.error("Launcher exited without starting the game")
+                self.trigger_exit(ExitCode.NO_GAME_PROCESS)
+                create_background_task(
+                    notify("Failed to find game PID, quitting", logging.ERROR)
+                )
+                self.subprocess_task = launcher_task
+                return -1
+            if self.loop.time() > deadline:
                 logger.error("Process not found within %d seconds", PROCESS_WAIT_TIME)
                 self.trigger_exit(ExitCode.NO_GAME_PROCESS)
                 create_background_task(
@@ -550,7 +619,9 @@ class Main:  # pylint: disable=too-many-instance-attributes
                 )
                 self.subprocess_task = launcher_task
                 return -1
-            procs = await asyncio.to_thread(pgrep, pattern)
+            # we're a child subreaper, so the game will always be one of our
+            # descendants
+            procs = await asyncio.to_thread(pgrep, pattern, root_pid=os.getpid())
             logger.debug("found: %s", procs)
             if len(procs) > 1:
                 logger.error("Multiple matching processes:")
@@ -559,12 +630,19 @@ class Main:  # pylint: disable=too-many-instance-attributes
                 self.trigger_exit(ExitCode.MULTIPLE_GAME_PROCESSES)
                 self.subprocess_task = launcher_task
                 return -1
-            await asyncio.sleep(0.5)
+            if not procs:
+                # look again right away if the launcher exits, since it has
+                # probably just started the game
+                if launcher_exited:
+                    await asyncio.sleep(interval)
+                else:
+                    await asyncio.wait([launcher_task], timeout=interval)
+                interval = min(interval * 2, PROCESS_POLL_INTERVAL)
 
-        watcher = asyncio.PidfdChildWatcher()
-        watcher.attach_loop(loop)
+        watcher = self.child_watcher
+        assert watcher is not None
 
-        process_fut: asyncio.Future[int] = loop.create_future()
+        process_fut: asyncio.Future[int] = self.loop.create_future()
 
         # found single process to wait for
         logger.debug("waiting on process %d", procs[0].pid)
@@ -580,28 +658,70 @@ class Main:  # pylint: disable=too-many-instance-attributes
         return returncode
 
     async def _run_game(self) -> None:
-        loop = asyncio.get_event_loop()
         # track focus
-        ft = FocusThread(self, loop)
-        ft.start()
-
-        # run command
-        proc = await asyncio.create_subprocess_exec(
-            self.command[0],
-            *self.command[1:],
-            env={**os.environ, **self.env_override},
-        )
+        self.start_focus_tracking()
+
+        # run command (we can't just exec it, since the stop time always has to
+        # be logged and the on_stop hooks run after it exits)
+        proc = await asyncio.create_subprocess_exec(*self.command, env=self.child_env)
 
         if not self.cfg.process_name:
             # just wait for subprocess to finish
             self.subprocess_task = create_background_task(self.wait_for_process(proc))
         else:
             # find main game process and wait for it to finish
-            self.subprocess_task = create_background_task(self.find_process(proc, loop))
+            self.subprocess_task = create_background_task(self.find_process(proc))
 
         # the stop event will be set by one of the subprocess callbacks or by
         # an error handler
-        await self.stop_event.wait()
+        try:
+            await self.stop_event.wait()
+        finally:
+            self.stop_focus_tracking()
+
+    ##################
+    # focus tracking #
+    ##################
+
+    def start_focus_tracking(self) -> None:
+        if not self.track_focus:
+            return
+        if not self.window_manager:
+            logger.debug("not in WM")
+            create_background_task(self.focused(datetime.now().astimezone()))
+            return
+        logger.debug("in WM, tracking focus")
+
+        self.focus_tracker = FocusTracker(
+            self.cfg.window_title,
+            self.cfg.window_class,
+            self.focus_changed,
+            self.window_wait_expired,
+        )
+        try:
+            self.focus_tracker.start(self.loop, WINDOW_WAIT_TIME)
+        except Xlib.error.DisplayError:
+            logger.exception("Couldn't connect to the X server to track focus")
+            self.focus_tracker = None
+
+    def stop_focus_tracking(self) -> None:
+        if self.focus_tracker is not None:
+            self.focus_tracker.close()
+            self.focus_tracker = None
+
+    def focus_changed(self, focused: bool, dt: datetime) -> None:
+        handler = self.focused if focused else self.unfocused
+        create_background_task(handler(dt))
+
+    def window_wait_expired(self) -> None:
+        create_background_task(
+            notify(
+                f"Window not found within {WINDOW_WAIT_TIME} seconds",
+                logging.ERROR,
+                log=True,
+            )
+        )
+        self.trigger_exit(ExitCode.NO_GAME_WINDOW)
 
     ##################
     # event handlers #
@@ -612,38 +732,46 @@ class Main:  # pylint: disable=too-many-instance-attributes
             self.stop_event.set()
             self.exit_code = exit_code
 
-    def log_time(self, event: Event, dt: Optional[arrow.Arrow] = None) -> None:
+    def log_time(self, event: Event, dt: Optional[datetime] = None) -> None:
         """
         Writes a message to the time logfile, if one exists.
         """
         if dt is None:
-            dt = arrow.now()
-        message = {
-            Event.START: "game started",
-            Event.STOP: "game stopped",
-            Event.UNFOCUS: "user left",
-            Event.FOCUS: "user returned",
-            Event.DIE: "wrapper died",
-        }[event]
-
-        if self.cfg.game == "Minecraft" and "INST_ID" in os.environ:
-            message += f" (instance: {os.environ['INST_ID']})"
+            dt = datetime.now().astimezone()
+        message = TIME_LOG_MESSAGES[event] + self.time_log_suffix
+        # e.g. 2023-06-01T12:34:56.789-05:00
+        timestamp = dt.isoformat(timespec="milliseconds")
+        if self.time_fd < 0:
+            self.time_fd = os.open(
+                self.time_logfile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666
+            )
+        # O_APPEND makes each write land at the end of the file in one piece
+        os.write(self.time_fd, f"{timestamp}: {message}\n".encode())
 
-        timestamp = dt.format("YYYY-MM-DDTHH:mm:ss.SSSZZ")
-        with open(self.time_logfile, "a") as logfile:
-            logfile.write(f"{timestamp}: {message}\n")
+    async def run_hooks(self, method: str) -> None:
+        """
+        Runs the given event handler of all the loaded hooks concurrently.
+        """
+        handlers = self.hook_handlers[method]
+        if not handlers:
+            return
+        results = await asyncio.gather(
+            *(handler() for _, handler in handlers), return_exceptions=True
+        )
+        for (name, _), result in zip(handlers, results):
+            if isinstance(result, Exception):
+                logger.error("hook %r failed in %s", name, method, exc_info=result)
 
-    async def started(self, dt: Optional[arrow.Arrow] = None) -> None:
+    async def started(self, dt: Optional[datetime] = None) -> None:
         """
         To be run when the game starts.
         """
         logger.debug("game starting...")
         self.log_time(Event.START, dt)
-        for hook in hooks.get_loaded_hooks().values():
-            await hook.on_start()
+        await self.run_hooks("on_start")
 
     async def stopped(
-        self, dt: Optional[arrow.Arrow] = None, killed: bool = False
+        self, dt: Optional[datetime] = None, killed: bool = False
     ) -> None:
         """
         To be run after the game exits.
@@ -654,28 +782,25 @@ class Main:  # pylint: disable=too-many-instance-attributes
             self.log_time(Event.DIE, dt)
         else:
             self.log_time(Event.STOP, dt)
-        for hook in hooks.get_loaded_hooks().values():
-            await hook.on_stop()
+        await self.run_hooks("on_stop")
 
-    async def focused(self, dt: Optional[arrow.Arrow] = None) -> None:
+    async def focused(self, dt: Optional[datetime] = None) -> None:
         """
         To be run when the game window is focused.
         """
         logger.debug("window focused")
         if lib.running:
             self.log_time(Event.FOCUS, dt)
-        for hook in hooks.get_loaded_hooks().values():
-            await hook.on_focus()
+        await self.run_hooks("on_focus")
 
-    async def unfocused(self, dt: Optional[arrow.Arrow] = None) -> None:
+    async def unfocused(self, dt: Optional[datetime] = None) -> None:
         """
         To be run when the game window loses focus.
         """
         logger.debug("window unfocused")
         if lib.running:
             self.log_time(Event.UNFOCUS, dt)
-        for hook in hooks.get_loaded_hooks().values():
-            await hook.on_unfocus()
+        await self.run_hooks("on_unfocus")
 
 
 @dataclass(init=False)
@@ -690,6 +815,7 @@ class _Arguments:  # pylint: disable=too-many-instance-attributes
     outfile: str
     classname: str
     test: bool
+    refresh_gpu: bool
 
 
 def parse_args() -> _Arguments:
@@ -753,6 +879,11 @@ def parse_args() -> _Arguments:
     )
     parser.add_argument("-c", "--classname", help="window classname to match against")
     parser.add_argument("-t", "--test", action="store_true")
+    parser.add_argument(
+        "--refresh-gpu",
+        help="check which GPUs work again, instead of using the cached result",
+        action="store_true",
+    )
 
     args = parser.parse_args(namespace=_Arguments())
 
@@ -799,11 +930,11 @@ def get_config(args: _Arguments) -> Config:
         config.command = args.command
 
     if args.use_gpu is not None:
-        config.flags.use_gpu = args.use_gpu
+        config.mutable_flags().use_gpu = args.use_gpu
 
     if args.hide_top_bar is not None:
         if "hide_top_bar" not in config.hooks:
-            config.hooks.append("hide_top_bar")
+            config.mutable_hooks().append("hide_top_bar")
 
     return config
 
@@ -833,7 +964,17 @@ def run() -> NoReturn:
         logger.error(cfg_err_msg)
         sys.exit(1)
 
-    main = Main(cfg)
+    # OPTIWRAPPER_GPU_CACHE=0 has the same effect as --refresh-gpu
+    use_gpu_cache = (
+        not args.refresh_gpu and os.environ.get("OPTIWRAPPER_GPU_CACHE") != "0"
+    )
+    main = Main(cfg, use_gpu_cache=use_gpu_cache)
+
+    # make sure the game process is reparented to us even if the launcher exits
+    # (imported here so that --help doesn't need it)
+    import pyprctl  # pylint: disable=import-outside-toplevel
+
+    pyprctl.set_child_subreaper(True)
 
     asyncio.run(main.run())
     sys.exit(main.exit_code.value)
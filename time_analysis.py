@@ -6,9 +6,10 @@ Analyzes playtime logs.
 import datetime
 import enum
 import functools
+import itertools
 import operator
 import sys
-from typing import List, NamedTuple, Optional
+from typing import Iterable, List, NamedTuple, Optional
 
 from optiwrapper.lib import WRAPPER_DIR
 
@@ -73,14 +74,16 @@ EVENT_PAIRS = {
 }
 
 
+ACTIONS = {
+    "game started": EventType.START,
+    "game stopped": EventType.STOP,
+    "wrapper died": EventType.STOP,
+    "user left": EventType.LEAVE,
+    "user returned": EventType.RETURN,
+}
+
+
 def parse(entry: str, line_num: int) -> Event:
-    ACTIONS = {
-        "game started": EventType.START,
-        "game stopped": EventType.STOP,
-        "wrapper died": EventType.STOP,
-        "user left": EventType.LEAVE,
-        "user returned": EventType.RETURN,
-    }
     dt, action = entry.split(": ")
     action = action.strip()
     if action not in ACTIONS:
@@ -93,6 +96,19 @@ def parse(entry: str, line_num: int) -> Event:
     return Event(event_type, datetime.datetime.fromisoformat(dt), line_num)
 
 
+def read_events(lines: Iterable[str]) -> List[Event]:
+    """
+    Parses the lines of a log file, and returns the events sorted by time.
+    """
+    # sorting by the timestamps directly avoids calling Event.__lt__ for every
+    # comparison (the log is almost always in order already, which Timsort
+    # handles in a single pass)
+    return sorted(
+        (parse(line, i) for i, line in enumerate(lines, 1)),
+        key=operator.attrgetter("time"),
+    )
+
+
 def process(events: List[Event], print_invalid: bool = True) -> List[Segment]:
     """
     Reads a list of events, and produces all the time segments when the user
@@ -103,7 +119,8 @@ def process(events: List[Event], print_invalid: bool = True) -> List[Segment]:
 
     segments = []
     curr_evt = events[0]
-    for line_num, next_evt in enumerate(events[1:], 2):
+    # iterate over the rest of the events without copying the list
+    for line_num, next_evt in enumerate(itertools.islice(events, 1, None), 2):
         if next_evt.event is None:
             continue
         if curr_evt.event is None:
@@ -149,24 +166,24 @@ if __name__ == "__main__":
         print(USAGE.format(sys.argv[0]))
         sys.exit(0)
 
+    # parse the lines as they're read, rather than reading the whole file
+    # into a list first
     if sys.argv[1] == "-":
-        lines = sys.stdin.readlines()
+        evts = read_events(sys.stdin)
     else:
         try:
-            with open(sys.argv[1], "r") as f:
-                lines = f.readlines()
+            f = open(sys.argv[1], "r")
         except OSError:
-            with open(WRAPPER_DIR / "time" / (sys.argv[1] + ".log"), "r") as f:
-                lines = f.readlines()
-
-    evts = sorted(parse(line, i) for i, line in enumerate(lines, 1))
+            f = open(WRAPPER_DIR / "time" / (sys.argv[1] + ".log"), "r")
+        with f:
+            evts = read_events(f)
 
     running_segs = process([e for e in evts if e.event in (START, STOP)], verbose)
     all_segs = process(evts, verbose)
 
-    run_time = functools.reduce(operator.add, (s.duration for s in running_segs))
+    run_time = sum((s.duration for s in running_segs), datetime.timedelta())
     run_hours = run_time.total_seconds() / 60 / 60
-    active_time = functools.reduce(operator.add, (s.duration for s in all_segs))
+    active_time = sum((s.duration for s in all_segs), datetime.timedelta())
     active_hours = active_time.total_seconds() / 60 / 60
     print("Total run time:    {} ({:.2f} hours)".format(run_time, run_hours))
     if any(e.event in (LEAVE, RETURN) for e in evts):